@@ -7,8 +7,8 @@ import torch
 import torch.distributed as dist
 
 from demo.lightning.checkpoint.simulated.multiprocessing_train import (
-    BenchmarkStrategy, cleanup, format_size, get_tensor_size_bytes,
-    time_checkpoint_operation)
+    PADDING_DTYPES, BenchmarkStrategy, cleanup, create_padding_state_dict,
+    format_size, get_tensor_size_bytes, time_checkpoint_operation)
 
 
 def configure_master_addr():
@@ -53,7 +53,8 @@ def init_processes() -> None:
 
 def run_benchmark(world_size: int, layer_size: int, project: str,
                   filepath: str, padding_size: int, sample_count: int,
-                  use_fsspec: bool) -> None:
+                  use_fsspec: bool, padding_dtype: str,
+                  thread_count: int) -> None:
 
     if os.environ.get("COORDINATOR_ADDRESS"):
         init_processes()
@@ -61,29 +62,43 @@ def run_benchmark(world_size: int, layer_size: int, project: str,
 
     benchmark_strategy = BenchmarkStrategy(project=project,
                                            path=filepath,
-                                           use_fsspec=use_fsspec)
-    # According to `create_default_local_load_plan` https://github.com/pytorch/pytorch/blob/v2.3.1/torch/distributed/checkpoint/default_planner.py#L227
-    # each key will be read only once from the state_dict, hence assigning different names to different tensor will force the load function to only read
-    # tensor shard corresponding to given node.
-    state_dict = dict()
-    for i in range(padding_size):
-        if i % world_size == rank:
-            state_dict[f'dummy_tensor_{i}'] = torch.randn(layer_size, 1000)
+                                           use_fsspec=use_fsspec,
+                                           thread_count=thread_count)
+    dtype = PADDING_DTYPES[padding_dtype]
+    state_dict = create_padding_state_dict(rank,
+                                           world_size,
+                                           padding_size,
+                                           layer_size,
+                                           dtype=dtype,
+                                           num_tensors=thread_count)
+
+    template_state_dict = {
+        k: torch.empty_like(v)
+        for k, v in state_dict.items()
+    }
 
     # Wait until the state_dict is populated properly accross all the nodes.
     dist.barrier()
 
     save_checkpoint_times = time_checkpoint_operation(benchmark_strategy,
-                                                      state_dict, filepath,
-                                                      sample_count, 'save',
-                                                      rank, world_size,
-                                                      padding_size, layer_size)
+                                                      state_dict,
+                                                      template_state_dict,
+                                                      filepath, sample_count,
+                                                      'save', rank)
 
     load_checkpoint_times = time_checkpoint_operation(benchmark_strategy,
-                                                      state_dict, filepath,
-                                                      sample_count, 'load',
-                                                      rank, world_size,
-                                                      padding_size, layer_size)
+                                                      state_dict,
+                                                      template_state_dict,
+                                                      filepath, sample_count,
+                                                      'load', rank)
+
+    # Padding is split unevenly when padding_size is not a multiple of
+    # world_size, so gather the actual shard size of every rank.
+    local_tensor_size = sum(
+        get_tensor_size_bytes(v) for v in state_dict.values())
+    sizes = [0] * world_size
+    dist.all_gather_object(sizes, local_tensor_size)
+    total_size_bytes = sum(sizes)
 
     if rank == 0:
         print(f"Time taken to save checkpoint:\
@@ -95,16 +110,13 @@ def run_benchmark(world_size: int, layer_size: int, project: str,
               )
         print(f"All load times: {load_checkpoint_times}")
 
-        tensor_size_per_instance = 1000 * layer_size * state_dict[
-            f'dummy_tensor_0'].element_size()
-        tensors_per_rank = padding_size // world_size
-        total_size_bytes = tensors_per_rank * tensor_size_per_instance * world_size
-        print(f"Size of distributed tensors (rank {rank}):\
-                 {format_size(tensors_per_rank * tensor_size_per_instance)}")
-        print(f"Total size of all tensors:\
-                 {format_size(total_size_bytes)}")
+        print(f"Size of distributed tensors per rank:")
+        for r, size in enumerate(sizes):
+            print(f"Rank {r}: {format_size(size)}")
+        print(f"Total size of all tensors: {format_size(total_size_bytes)}")
         print("######################")
 
+    benchmark_strategy.close()
     cleanup()
 
 
@@ -117,8 +129,10 @@ def main() -> None:
     padding_size = int(os.getenv("PADDING_SIZE", 4000))
     use_fsspec = os.getenv("USE_FSSPEC",
                            "False").lower() in ("true", "1", "yes")
+    padding_dtype = os.getenv("PADDING_DTYPE", "float32")
+    thread_count = int(os.getenv("THREAD_COUNT", 1))
     run_benchmark(world_size, layer_size, project, ckpt_dir_path, padding_size,
-                  sample_count, use_fsspec)
+                  sample_count, use_fsspec, padding_dtype, thread_count)
 
 
 if __name__ == "__main__":
@@ -17,20 +17,19 @@ import argparse
 import os
 import statistics
 import time
-from typing import Dict, Optional, TextIO
+from typing import Dict, Optional
 
 import torch
 import torch.distributed as dist
 import torch.distributed.checkpoint as dist_cp
 import torch.multiprocessing as mp
-import torch.nn as nn
 from lightning.pytorch.strategies import FSDPStrategy
 from torch.distributed.checkpoint import _fsspec_filesystem as FF
 
 from dataflux_pytorch.lightning.gcs_filesystem import (GCSDistributedReader,
                                                        GCSDistributedWriter)
-from demo.lightning.checkpoint.simulated.llama2_utils import (
-    ModelConfig, create_llama2_state_dict)
+from demo.lightning.checkpoint.simulated.llama2_utils import \
+    create_llama2_state_dict
 
 # Constants for distributed setup
 MASTER_ADDR = 'localhost'
@@ -181,18 +180,10 @@ def cleanup() -> None:
 
 def time_checkpoint_operation(benchmark_strategy: BenchmarkStrategy,
                               distributed_state_dict: Dict[str, torch.Tensor],
+                              template_state_dict: Dict[str, torch.Tensor],
                               filepath: str, sample_count: int, operation: str,
-                              rank: int, world_size: int,
-                              model_parameter_size: str,
-                              optimizer: str) -> list:
+                              rank: int) -> list:
     times = []
-    template_state_dict = create_llama2_state_dict(
-        world_size=world_size,
-        rank=rank,
-        parameters=model_parameter_size,
-        optimizer=optimizer,
-        empty=True)
-
     for i in range(sample_count):
         checkpoint_path = os.path.join(filepath, f'checkpoints/ckpt_{i}.ckpt')
         dist.barrier()
@@ -214,7 +205,7 @@ def time_checkpoint_operation(benchmark_strategy: BenchmarkStrategy,
 
 def run_benchmark(rank, world_size: int, project: str, filepath: str,
                   sample_count: int, use_fsspec: bool,
-                  model_parameter_size: str) -> None:
+                  model_parameter_size: str, optimizer: str) -> None:
     setup(rank, world_size)
 
     benchmark_strategy = BenchmarkStrategy(project=project,
@@ -224,20 +215,27 @@ def run_benchmark(rank, world_size: int, project: str, filepath: str,
     state_dict = create_llama2_state_dict(world_size=world_size,
                                           rank=rank,
                                           parameters=model_parameter_size,
+                                          optimizer=optimizer,
                                           empty=False)
+    # The load template only needs the layout of the state dict, so it is
+    # allocated uninitialized from it once rather than per operation.
+    template_state_dict = {
+        k: torch.empty_like(v)
+        for k, v in state_dict.items()
+    }
 
     dist.barrier()
     save_checkpoint_times = time_checkpoint_operation(benchmark_strategy,
-                                                      state_dict, filepath,
-                                                      sample_count, 'save',
-                                                      rank, world_size,
-                                                      model_parameter_size)
+                                                      state_dict,
+                                                      template_state_dict,
+                                                      filepath, sample_count,
+                                                      'save', rank)
 
     load_checkpoint_times = time_checkpoint_operation(benchmark_strategy,
-                                                      state_dict, filepath,
-                                                      sample_count, 'load',
-                                                      rank, world_size,
-                                                      model_parameter_size)
+                                                      state_dict,
+                                                      template_state_dict,
+                                                      filepath, sample_count,
+                                                      'load', rank)
 
     if rank == 0:
         print(f"Time taken to save checkpoint:\
@@ -280,7 +278,7 @@ def main() -> None:
     mp.spawn(run_benchmark,
              args=(args.world_size, args.project, args.ckpt_dir_path,
                    args.sample_count, args.use_fsspec,
-                   args.model_parameter_size),
+                   args.model_parameter_size, args.optimizer),
              nprocs=args.world_size,
              join=True)
 
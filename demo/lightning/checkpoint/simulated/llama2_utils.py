@@ -139,7 +139,7 @@ def create_llama2_state_dict(world_size: int,
 
     model_config = models[parameters]
     if optimizer.lower() not in ['sgd', 'adamw']:
-        return ValueError("Invalid optmizer. Must be either sgd or adamW")
+        raise ValueError("Invalid optmizer. Must be either sgd or adamW")
     use_adamw = optimizer.lower() == 'adamw'
 
     state_dict = {}
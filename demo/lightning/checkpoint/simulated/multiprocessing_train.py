@@ -14,22 +14,33 @@
  limitations under the License.
  """
 import argparse
+import gc
+import inspect
 import os
 import statistics
 import time
-from typing import Dict, Optional, TextIO
+from concurrent.futures import Future
+from typing import Dict, List, Optional
 
+import numpy as np
 import torch
 import torch.distributed as dist
 import torch.distributed.checkpoint as dist_cp
 import torch.multiprocessing as mp
-import torch.nn as nn
 from lightning.pytorch.strategies import FSDPStrategy
+from torch.distributed.checkpoint import DefaultLoadPlanner, DefaultSavePlanner
 from torch.distributed.checkpoint import _fsspec_filesystem as FF
 
 from dataflux_pytorch.lightning.gcs_filesystem import (GCSDistributedReader,
                                                        GCSDistributedWriter)
 
+try:
+    from torch.distributed.checkpoint.staging import (DefaultStager,
+                                                      StagingOptions)
+except ImportError:
+    # Configurable staging is only available on newer torch versions.
+    DefaultStager = None
+
 # Constants for distributed setup
 MASTER_ADDR = 'localhost'
 MASTER_PORT = '12355'
@@ -38,15 +49,36 @@ BYTES_PER_KB = 1024
 BYTES_PER_MB = BYTES_PER_KB * 1024
 BYTES_PER_GB = BYTES_PER_MB * 1024
 
+FILE_SCHEME = 'file://'
+
+# Supported data types for the dummy padding tensors. The values carry no
+# information, so narrower types reduce the bytes transferred per tensor.
+PADDING_DTYPES = {
+    "float32": torch.float32,
+    "bfloat16": torch.bfloat16,
+    "int8": torch.int8,
+}
+
+DEBUG_FORMAT_EXTENSIONS = {"text": "txt", "binary": "pt"}
+
 
 def write_state_dict_to_file(state_dict: Dict[str, torch.Tensor],
-                             filename: str) -> None:
+                             filename: str,
+                             debug_format: str = "text") -> None:
+    if debug_format == "binary":
+        torch.save(state_dict, filename)
+        return
+    lines = ["State Dict:\n"]
+    for key, value in state_dict.items():
+        if value.dtype == torch.bfloat16:
+            # numpy has no bfloat16 type.
+            value = value.float()
+        values = np.array2string(value.numpy(), threshold=1000, precision=4)
+        lines.append(f"{key}:\n")
+        lines.append(f"  Shape: {value.shape}\n")
+        lines.append(f"  Values: {values}\n")
     with open(filename, 'w') as f:
-        f.write("State Dict:\n")
-        for key, value in state_dict.items():
-            f.write(f"{key}:\n")
-            f.write(f"  Shape: {value.shape}\n")
-            f.write(f"  Values: {value}\n")
+        f.write(''.join(lines))
 
 
 def format_size(size_bytes: int) -> str:
@@ -64,11 +96,120 @@ def format_size(size_bytes: int) -> str:
         return f"{size_gb:.2f} GB"
 
 
+def is_local_path(path: str) -> bool:
+    """Returns True if the path points to the local filesystem."""
+    return path.startswith(('/', FILE_SCHEME))
+
+
+def strip_file_scheme(path: str) -> str:
+    """Removes the file:// scheme from a path, if present."""
+    if path.startswith(FILE_SCHEME):
+        return path[len(FILE_SCHEME):]
+    return path
+
+
 def get_tensor_size_bytes(tensor: torch.Tensor) -> int:
     """Calculates the size of a tensor in bytes."""
     return tensor.element_size() * tensor.numel()
 
 
+def create_padding_state_dict(rank: int,
+                              world_size: int,
+                              padding_size: int,
+                              layer_size: int,
+                              dtype: torch.dtype = torch.float32,
+                              num_tensors: int = 1) -> Dict[str, torch.Tensor]:
+    """
+    Creates the dummy padding tensors owned by the given rank.
+
+    The padding_size tensors of shape (layer_size, 1000) are distributed
+    round-robin across ranks, and each rank's share is allocated as
+    num_tensors contiguous tensors. This keeps the number of state dict
+    entries, and with it the size of the save plan and checkpoint metadata,
+    independent of padding_size, while still giving each writer thread its
+    own tensor to upload.
+
+    Args:
+        rank: Current process index.
+        world_size: Total number of processes.
+        padding_size: Total number of dummy tensors across all ranks.
+        layer_size: Size of the first dimension of each dummy tensor.
+        dtype: Data type of the padding tensors.
+        num_tensors: Number of tensors to split this rank's padding into.
+
+    Returns:
+        State dictionary containing this rank's padding tensors.
+    """
+    tensors_per_rank = len(range(rank, padding_size, world_size))
+    num_tensors = max(1, min(num_tensors, tensors_per_rank))
+    state_dict = {}
+    for i in range(num_tensors):
+        shape = (len(range(i, tensors_per_rank,
+                           num_tensors)), layer_size, 1000)
+        # The values do not matter for the benchmark, so the tensor is left
+        # uninitialized instead of spending time on random number generation.
+        padding = torch.empty(*shape, dtype=dtype)
+        # According to `create_default_local_load_plan` https://github.com/pytorch/pytorch/blob/main/torch/distributed/checkpoint/default_planner.py#L343
+        # each key will be read only once from the state_dict, hence assigning different names on different ranks will force the load function to only read
+        # tensor shard corresponding to given node.
+        state_dict[f'dummy_pad_{rank}_{i}'] = padding
+    return state_dict
+
+
+def create_shared_paddings(world_size: int,
+                           padding_size: int,
+                           layer_size: int,
+                           dtype: torch.dtype = torch.float32,
+                           num_tensors: int = 1) -> List[List[torch.Tensor]]:
+    """
+    Creates the padding tensors of every rank in shared memory.
+
+    The padding values carry no information, so ranks whose padding has the
+    same layout can save from the same tensors. Round-robin distribution
+    produces at most two distinct layouts, which keeps host memory for the
+    padding close to that of two shards regardless of world_size.
+
+    Args:
+        world_size: Total number of processes.
+        padding_size: Total number of dummy tensors across all ranks.
+        layer_size: Size of the first dimension of each dummy tensor.
+        dtype: Data type of the padding tensors.
+        num_tensors: Number of tensors to split each rank's padding into.
+
+    Returns:
+        The padding tensors of each rank, indexed by rank.
+    """
+    paddings_by_count = {}
+    paddings = []
+    for rank in range(world_size):
+        tensors_per_rank = len(range(rank, padding_size, world_size))
+        if tensors_per_rank not in paddings_by_count:
+            state_dict = create_padding_state_dict(rank,
+                                                   world_size,
+                                                   padding_size,
+                                                   layer_size,
+                                                   dtype=dtype,
+                                                   num_tensors=num_tensors)
+            paddings_by_count[tensors_per_rank] = [
+                padding.share_memory_() for padding in state_dict.values()
+            ]
+        paddings.append(paddings_by_count[tensors_per_rank])
+    return paddings
+
+
+def create_save_planner() -> DefaultSavePlanner:
+    """Creates a save planner that caches the save plan between calls.
+
+    The benchmark saves a state dict with the same layout on every sample, so
+    the plan only needs to be computed once. Plan caching is only available
+    on newer torch versions; older versions fall back to the default planner.
+    """
+    if "enable_plan_caching" in inspect.signature(
+            DefaultSavePlanner.__init__).parameters:
+        return DefaultSavePlanner(enable_plan_caching=True)
+    return DefaultSavePlanner()
+
+
 def parse_args() -> argparse.Namespace:
     """Parses command line arguments."""
     parser = argparse.ArgumentParser(
@@ -77,10 +218,12 @@ def parse_args() -> argparse.Namespace:
                         type=str,
                         required=True,
                         help="GCS project ID.")
-    parser.add_argument("--ckpt-dir-path",
-                        type=str,
-                        required=True,
-                        help="Path to GCS bucket for checkpoints.")
+    parser.add_argument(
+        "--ckpt-dir-path",
+        type=str,
+        required=True,
+        help=("Path to GCS bucket for checkpoints. Local paths starting with "
+              "'/' or 'file://' are also supported for development runs."))
     parser.add_argument("--layer-size",
                         type=int,
                         default=100,
@@ -97,6 +240,12 @@ def parse_args() -> argparse.Namespace:
                         type=int,
                         default=1000,
                         help="Size of dummy tensors for padding.")
+    parser.add_argument(
+        "--padding-dtype",
+        type=str,
+        default="float32",
+        choices=list(PADDING_DTYPES),
+        help="Data type of the dummy tensors used for padding.")
     parser.add_argument("--world-size",
                         type=int,
                         required=True,
@@ -105,6 +254,25 @@ def parse_args() -> argparse.Namespace:
                         action="store_true",
                         default=False,
                         help="Enable debug mode.")
+    parser.add_argument(
+        "--debug-format",
+        type=str,
+        default="text",
+        choices=list(DEBUG_FORMAT_EXTENSIONS),
+        help=("Format of the state dicts written in debug mode. 'text' writes "
+              "a summarized dump, 'binary' writes them with torch.save."))
+    parser.add_argument(
+        "--thread-count",
+        type=int,
+        default=1,
+        help=("Number of threads each rank uses to write its checkpoint "
+              "shard. Each thread writes a separate file."))
+    parser.add_argument(
+        "--async-blocking-only",
+        action="store_true",
+        default=False,
+        help=("Only time the blocking portion of async_save instead of "
+              "waiting for the upload to complete in each sample."))
     parser.add_argument(
         "--use-fsspec",
         action="store_true",
@@ -118,23 +286,58 @@ def parse_args() -> argparse.Namespace:
 
 class BenchmarkStrategy(FSDPStrategy):
 
-    def __init__(self, project: str, path: str, use_fsspec: bool, **kwargs):
+    def __init__(self,
+                 project: str,
+                 path: str,
+                 use_fsspec: bool,
+                 thread_count: int = 1,
+                 **kwargs):
         super().__init__(**kwargs)
-        if use_fsspec:
+        if is_local_path(path):
+            local_path = strip_file_scheme(path)
+            self.writer = dist_cp.FileSystemWriter(local_path,
+                                                   sync_files=False,
+                                                   thread_count=thread_count)
+            self.reader = dist_cp.FileSystemReader(local_path)
+        elif use_fsspec:
             self.reader = FF.FsspecReader(path)
-            self.writer = FF.FsspecWriter(path, sync_files=False)
+            self.writer = FF.FsspecWriter(path,
+                                          sync_files=False,
+                                          thread_count=thread_count)
         else:
-            self.writer = GCSDistributedWriter(path, project, None)
+            self.writer = GCSDistributedWriter(path,
+                                               project,
+                                               None,
+                                               thread_count=thread_count)
             self.reader = GCSDistributedReader(path, project, None)
+        # Planners are kept on the strategy so they persist across samples.
+        self.save_planner = create_save_planner()
+        self.load_planner = DefaultLoadPlanner()
+
+        # Attributes used for async behavior. Background uploads run their
+        # collectives on a dedicated gloo group so they do not interleave with
+        # the barriers issued on the default group by the benchmark loop.
+        self.checkpoint_group = dist.new_group(backend="gloo")
+        self._checkpoint_future = None
+        # Staging into reusable pinned buffers makes device to host copies
+        # asynchronous and avoids reallocating them on every save. Pinning
+        # requires CUDA, so CPU-only runs only use shared memory staging.
+        self.stager = None
+        if DefaultStager is not None:
+            self.stager = DefaultStager(
+                StagingOptions(use_pinned_memory=torch.cuda.is_available(),
+                               use_shared_memory=True,
+                               use_async_staging=True))
 
     def save_checkpoint(self,
                         checkpoint: Dict[str, torch.Tensor],
                         filepath: str,
-                        storage_options: Optional[Dict] = None) -> None:
+                        storage_options: Optional[Dict] = None) -> Future:
         """
         Saves the model's state dictionary to a specified file path in GCS.
-        torch.distributed.checkpoint.save contains the core logic for saving
-        model shards.
+        torch.distributed.checkpoint.async_save contains the core logic for
+        saving model shards. The upload runs in the background; any previous
+        save is awaited before a new one is started.
         Source code for FSDP.save_checkpoint can be found at
         https://github.com/Lightning-AI/pytorch-lightning/blob/master/src/lightning/pytorch/strategies/fsdp.py#L553 .
         Args:
@@ -144,11 +347,45 @@ class BenchmarkStrategy(FSDPStrategy):
             storage_options (Optional[Dict]): Additional storage options
             (if any).
 
+        Returns:
+            Future: Resolves once the checkpoint has been fully written.
+
         This method uses the GCS writer to save the checkpoint.
         """
-        dist_cp.save(state_dict=checkpoint,
-                     checkpoint_id=filepath,
-                     storage_writer=self.writer)
+        self.resolve_future()
+        kwargs = {}
+        if self.stager is not None:
+            kwargs["async_stager"] = self.stager
+        response = dist_cp.async_save(
+            state_dict=checkpoint,
+            checkpoint_id=strip_file_scheme(filepath),
+            storage_writer=self.writer,
+            planner=self.save_planner,
+            process_group=self.checkpoint_group,
+            **kwargs)
+        # With asynchronous staging, async_save returns separate staging and
+        # upload futures; only the upload one signals a finished checkpoint.
+        self._checkpoint_future = getattr(response, "upload_completion",
+                                          response)
+        return self._checkpoint_future
+
+    def resolve_future(self) -> None:
+        """Resolve previous async future if one exists.
+
+        If a previous future exists, wait for checkpointing to finish,
+        avoiding queuing more than one checkpoint request at a time.
+        """
+        if self._checkpoint_future is not None:
+            self._checkpoint_future.result()
+            # Drop the reference so the staged copy of the state dict can be
+            # freed before the next save.
+            self._checkpoint_future = None
+
+    def close(self) -> None:
+        """Waits for any pending save and releases the staging buffers."""
+        self.resolve_future()
+        if self.stager is not None:
+            self.stager.close()
 
     def load_checkpoint(self, checkpoint_path: str,
                         initial_state_dict: Dict) -> None:
@@ -173,8 +410,9 @@ class BenchmarkStrategy(FSDPStrategy):
         state dictionary.
         """
         dist_cp.load(state_dict=initial_state_dict,
-                     checkpoint_id=checkpoint_path,
-                     storage_reader=self.reader)
+                     checkpoint_id=strip_file_scheme(checkpoint_path),
+                     storage_reader=self.reader,
+                     planner=self.load_planner)
 
 
 def setup(rank: int, world_size: int) -> None:
@@ -190,9 +428,12 @@ def cleanup() -> None:
 
 def time_checkpoint_operation(benchmark_strategy: BenchmarkStrategy,
                               distributed_state_dict: Dict[str, torch.Tensor],
-                              filepath: str, sample_count: int, operation: str,
-                              rank: int, world_size: int, tensor_count: int,
-                              tensor_size: int) -> list:
+                              template_state_dict: Dict[str, torch.Tensor],
+                              filepath: str,
+                              sample_count: int,
+                              operation: str,
+                              rank: int,
+                              async_blocking_only: bool = False) -> list:
     """
     Times the save or load operations for checkpoints.
 
@@ -201,9 +442,14 @@ def time_checkpoint_operation(benchmark_strategy: BenchmarkStrategy,
         checkpoint operations.
         distributed_state_dict (Dict[str, torch.Tensor]): The model's state
         dictionary split across processes.
+        template_state_dict (Dict[str, torch.Tensor]): A state dictionary
+        with the same layout as distributed_state_dict that loads are read
+        into.
         filepath (str): The path to store/load checkpoints.
         sample_count (int): The number of samples to benchmark.
         operation (str): The operation to perform ('save' or 'load').
+        async_blocking_only (bool): If True, save times only cover the
+        blocking portion of async_save rather than the full upload.
 
     Returns:
         list: A list of times taken for each operation in seconds.
@@ -212,22 +458,21 @@ def time_checkpoint_operation(benchmark_strategy: BenchmarkStrategy,
     saving/loading under distributed settings.
     """
     times = []
-    template_state_dict = dict()
-    # According to `create_default_local_load_plan` https://github.com/pytorch/pytorch/blob/main/torch/distributed/checkpoint/default_planner.py#L343
-    # each key will be read only once from the state_dict, hence assigning different names to different tensor will force the load function to only read
-    # tensor shard corresponding to given node.
-    for i in range(tensor_count):
-        if i % world_size == rank:
-            template_state_dict[f'dummy_tensor_{i}'] = torch.empty(
-                tensor_size, 1000)
     for i in range(sample_count):
         checkpoint_path = os.path.join(filepath, f'checkpoints/ckpt_{i}.ckpt')
+        if async_blocking_only:
+            # Wait for the previous upload outside of the timed region so the
+            # sample only covers the blocking portion of async_save.
+            benchmark_strategy.resolve_future()
         dist.barrier()
         print(f"Started iteration {i} for {operation} on rank {rank}...")
         start_time = time.time()
         if operation == 'save':
-            benchmark_strategy.save_checkpoint(distributed_state_dict,
-                                               filepath=checkpoint_path)
+            future = benchmark_strategy.save_checkpoint(
+                distributed_state_dict, filepath=checkpoint_path)
+            if not async_blocking_only:
+                future.result()
+            del future
         elif operation == 'load':
             benchmark_strategy.load_checkpoint(
                 checkpoint_path=checkpoint_path,
@@ -236,43 +481,76 @@ def time_checkpoint_operation(benchmark_strategy: BenchmarkStrategy,
         end_time = time.time()
         times.append(end_time - start_time)
         print(f"Completed iteration {i} for {operation} on rank {rank}")
+        # Release buffers from this sample outside of the timed region so
+        # memory usage does not grow across samples.
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    # Make sure the last checkpoint is fully written before it is loaded.
+    benchmark_strategy.resolve_future()
     return times
 
 
-def run_benchmark(rank, world_size: int, layer_size: int, project: str,
-                  filepath: str, padding_size: int, sample_count: int,
-                  debug: bool, use_fsspec: bool) -> None:
+def run_benchmark(rank, world_size: int, project: str, filepath: str,
+                  sample_count: int, debug: bool, use_fsspec: bool,
+                  async_blocking_only: bool, thread_count: int,
+                  debug_format: str,
+                  shared_paddings: List[List[torch.Tensor]]) -> None:
     setup(rank, world_size)
 
     benchmark_strategy = BenchmarkStrategy(project=project,
                                            path=filepath,
-                                           use_fsspec=use_fsspec)
-
-    state_dict = dict()
-    for i in range(padding_size):
-        if i % world_size == rank:
-            state_dict[f'dummy_tensor_{i}'] = torch.randn(layer_size, 1000)
-
+                                           use_fsspec=use_fsspec,
+                                           thread_count=thread_count)
+
+    # Keys stay unique per rank even when the tensors are shared, so DCP
+    # still treats every rank's padding as a separate shard.
+    state_dict = {
+        f'dummy_pad_{rank}_{i}': padding
+        for i, padding in enumerate(shared_paddings[rank])
+    }
+
+    # The load template is built once, outside of the timed operations.
+    template_state_dict = {
+        k: torch.empty_like(v)
+        for k, v in state_dict.items()
+    }
+
+    debug_extension = DEBUG_FORMAT_EXTENSIONS[debug_format]
     if rank == 0 and debug:
         print("Writing state dict before saving to file...")
-        write_state_dict_to_file(state_dict, "state_dict_before_save.txt")
+        write_state_dict_to_file(state_dict,
+                                 f"state_dict_before_save.{debug_extension}",
+                                 debug_format)
         print("Shapes before saving:", {
             k: v.shape
             for k, v in state_dict.items()
         })
 
     dist.barrier()
-    save_checkpoint_times = time_checkpoint_operation(benchmark_strategy,
-                                                      state_dict, filepath,
-                                                      sample_count, 'save',
-                                                      rank, world_size,
-                                                      padding_size, layer_size)
+    save_checkpoint_times = time_checkpoint_operation(
+        benchmark_strategy,
+        state_dict,
+        template_state_dict,
+        filepath,
+        sample_count,
+        'save',
+        rank,
+        async_blocking_only=async_blocking_only)
 
     load_checkpoint_times = time_checkpoint_operation(benchmark_strategy,
-                                                      state_dict, filepath,
-                                                      sample_count, 'load',
-                                                      rank, world_size,
-                                                      padding_size, layer_size)
+                                                      state_dict,
+                                                      template_state_dict,
+                                                      filepath, sample_count,
+                                                      'load', rank)
+
+    # Padding is split unevenly when padding_size is not a multiple of
+    # world_size, so gather the actual shard size of every rank.
+    local_tensor_size = sum(
+        get_tensor_size_bytes(v) for v in state_dict.values())
+    sizes = [0] * world_size
+    dist.all_gather_object(sizes, local_tensor_size)
+    total_size_bytes = sum(sizes)
 
     if rank == 0:
         print(f"Time taken to save checkpoint:\
@@ -284,24 +562,23 @@ def run_benchmark(rank, world_size: int, layer_size: int, project: str,
               )
         print(f"All load times: {load_checkpoint_times}")
 
-        tensor_size_per_instance = 1000 * layer_size * state_dict[
-            f'dummy_tensor_0'].element_size()
-        tensors_per_rank = padding_size // world_size
-        total_size_bytes = tensors_per_rank * tensor_size_per_instance * world_size
-        print(f"Size of distributed tensors (rank {rank}):\
-                 {format_size(tensors_per_rank * tensor_size_per_instance)}")
-        print(f"Total size of all tensors:\
-                 {format_size(total_size_bytes)}")
+        print(f"Size of distributed tensors per rank:")
+        for r, size in enumerate(sizes):
+            print(f"Rank {r}: {format_size(size)}")
+        print(f"Total size of all tensors: {format_size(total_size_bytes)}")
         print("######################")
 
         if debug:
             print("State dict after loading:")
-            write_state_dict_to_file(state_dict, "state_dict_after_load.txt")
+            write_state_dict_to_file(
+                template_state_dict,
+                f"state_dict_after_load.{debug_extension}", debug_format)
             print("Shapes after loading:", {
                 k: v.shape
-                for k, v in state_dict.items()
+                for k, v in template_state_dict.items()
             })
 
+    benchmark_strategy.close()
     cleanup()
 
 
@@ -318,10 +595,18 @@ def main() -> None:
     args = parse_args()
 
     mp.set_start_method('spawn')
+    mp.set_sharing_strategy('file_system')
+    shared_paddings = create_shared_paddings(
+        args.world_size,
+        args.padding_size,
+        args.layer_size,
+        dtype=PADDING_DTYPES[args.padding_dtype],
+        num_tensors=args.thread_count)
     mp.spawn(run_benchmark,
-             args=(args.world_size, args.layer_size, args.project,
-                   args.ckpt_dir_path, args.padding_size, args.sample_count,
-                   args.debug, args.use_fsspec),
+             args=(args.world_size, args.project, args.ckpt_dir_path,
+                   args.sample_count, args.debug, args.use_fsspec,
+                   args.async_blocking_only, args.thread_count,
+                   args.debug_format, shared_paddings),
              nprocs=args.world_size,
              join=True)
 